@@ -7,11 +7,19 @@ from fastapi import Depends, FastAPI
 
 app = FastAPI()
 
+# NOTE: one shared Session keeps the TCP connection and urllib3 pool alive
+# between calls instead of building a fresh adapter per requests.get(..)
+_http = requests.Session()
+
 # NOTE:
 # that generator wrapped into @contextlib.contextmanager by fastAPI internally
 # when it passe to Depends(..)
 #
-def my_dependence():
+# NOTE:
+# async def here, because fastAPI offloads *sync* dependencies and routes to a
+# threadpool (run_in_threadpool) -- pure overhead for trivial python work
+#
+async def my_dependence():
     print('dependence in')
     yield 'depended value'
     print('dependence out')
@@ -22,15 +30,22 @@ def my_custom_file_open():
 
 
 @app.get("/")
-def read_root(d=Depends(my_dependence)):
+async def read_root(d=Depends(my_dependence)):
     return {'value': str(d)}
 
 
 if __name__ == '__main__':
-    run = lambda: uvicorn.run(app, host='0.0.0.0', port=5001)
-    Thread(target=run).start()
+    # NOTE:
+    # uvicorn.Server gives a clean shutdown handle (should_exit) instead of a
+    # dangling thread; log_level='warning' trims per-request stdout noise
+    config = uvicorn.Config(app, host='0.0.0.0', port=5001, log_level='warning')
+    server = uvicorn.Server(config)
+    Thread(target=server.run).start()
 
 if __name__ == '__main__':
-    sleep(1)
-    response = requests.get('http://0.0.0.0:5001')
-    print(response, response.json())
+    try:
+        sleep(1)
+        response = _http.get('http://0.0.0.0:5001')
+        print(response, response.json())
+    finally:
+        server.should_exit = True
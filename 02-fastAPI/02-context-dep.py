@@ -7,6 +7,10 @@ from fastapi import Depends, FastAPI
 
 app = FastAPI()
 
+# NOTE: one shared Session keeps the TCP connection and urllib3 pool alive
+# between calls instead of building a fresh adapter per requests.get(..)
+_http = requests.Session()
+
 
 class MyContext:
     def __enter__(self):
@@ -17,27 +21,41 @@ class MyContext:
         print(f'my context exit: {exc_type, exc_value, traceback}')
 
 
+# NOTE:
+# MyContext is stateless, so one module-level instance is enough -- no need to
+# allocate a fresh context object on every request
+_CTX = MyContext()
+
+
 # NOTE
 # the same as simple dependence, that generator wrapped into @contextlib.contextmanager
 # but thanks MyContext(..) we have more ways to control context behavior
 #
-def my_dependence():
+# NOTE: async def to avoid fastAPI threadpool dispatch (see 01-simple-dep.py)
+async def my_dependence():
     print('dependence in')
-    with MyContext() as context:
+    with _CTX as context:
         yield '<hi, i`m in context>'
     print('dependence out')
 
 
 @app.get("/")
-def read_root(d=Depends(my_dependence)):
+async def read_root(d=Depends(my_dependence)):
     return {'value': str(d)}
 
 
 if __name__ == '__main__':
-    run = lambda: uvicorn.run(app, host='0.0.0.0', port=5001)
-    Thread(target=run).start()
+    # NOTE:
+    # uvicorn.Server gives a clean shutdown handle (should_exit) instead of a
+    # dangling thread; log_level='warning' trims per-request stdout noise
+    config = uvicorn.Config(app, host='0.0.0.0', port=5001, log_level='warning')
+    server = uvicorn.Server(config)
+    Thread(target=server.run).start()
 
 if __name__ == '__main__':
-    sleep(1)
-    response = requests.get('http://0.0.0.0:5001')
-    print(response, response.json())
+    try:
+        sleep(1)
+        response = _http.get('http://0.0.0.0:5001')
+        print(response, response.json())
+    finally:
+        server.should_exit = True
@@ -8,6 +8,10 @@ from fastapi import Depends, FastAPI, HTTPException
 
 app = FastAPI()
 
+# NOTE: one shared Session keeps the TCP connection and urllib3 pool alive
+# between calls instead of building a fresh adapter per requests.get(..)
+_http = requests.Session()
+
 ########################################################################################
 # option 1
 ########################################################################################
@@ -19,7 +23,8 @@ app = FastAPI()
 contextlib.contextmanager
 
 
-def my_dependence_v1():
+# NOTE: async def to avoid fastAPI threadpool dispatch (see 01-simple-dep.py)
+async def my_dependence_v1():
     print('dependence in')
     try:
         yield '<hi, i`m in context>'
@@ -66,17 +71,24 @@ def my_dependence_v1():
 
 
 @app.get("/")
-def read_root(d=Depends(my_dependence_v1)):
+async def read_root(d=Depends(my_dependence_v1)):
     raise HTTPException(400, 'bad thing')
     # raise ValueError  # make respone with 500 status code
     return {'value': str(d)}
 
 
 if __name__ == '__main__':
-    run = lambda: uvicorn.run(app, host='0.0.0.0', port=5001)
-    Thread(target=run).start()
+    # NOTE:
+    # uvicorn.Server gives a clean shutdown handle (should_exit) instead of a
+    # dangling thread; log_level='warning' trims per-request stdout noise
+    config = uvicorn.Config(app, host='0.0.0.0', port=5001, log_level='warning')
+    server = uvicorn.Server(config)
+    Thread(target=server.run).start()
 
 if __name__ == '__main__':
-    sleep(1)
-    response = requests.get('http://0.0.0.0:5001')
-    print(response, response.json())
+    try:
+        sleep(1)
+        response = _http.get('http://0.0.0.0:5001')
+        print(response, response.json())
+    finally:
+        server.should_exit = True